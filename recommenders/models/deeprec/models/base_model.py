@@ -552,17 +552,14 @@ class BaseModel:
             - Labels after group.
             - Predictions after group.
         """
-        all_keys = list(set(group_keys))
+        all_keys = np.unique(np.asarray(group_keys)).tolist()
         group_labels = {k: [] for k in all_keys}
         group_preds = {k: [] for k in all_keys}
         for label, p, k in zip(labels, preds, group_keys):
             group_labels[k].append(label)
             group_preds[k].append(p)
-        all_labels = []
-        all_preds = []
-        for k in all_keys:
-            all_labels.append(group_labels[k])
-            all_preds.append(group_preds[k])
+        all_labels = [group_labels[k] for k in all_keys]
+        all_preds = [group_preds[k] for k in all_keys]
         return all_labels, all_preds
 
     def run_eval(self, filename):
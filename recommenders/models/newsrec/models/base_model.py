@@ -2,8 +2,12 @@
 # Licensed under the MIT License.
 
 import abc
+import hashlib
+import os
+import tempfile
 import time
 import numpy as np
+from numba import njit
 from tqdm import tqdm
 import tensorflow as tf
 from tensorflow import keras
@@ -16,6 +20,61 @@ from recommenders.models.deeprec.deeprec_utils import cal_metric
 __all__ = ["BaseModel"]
 
 
+@tf.function(jit_compile=True)
+def _masked_gather_dot(news_matrix, user_matrix, news_idx, user_idx, mask):
+    """Dot product between the candidate news and the user of padded impressions."""
+    news_vecs = tf.cast(tf.gather(news_matrix, news_idx), tf.float32)
+    user_vecs = tf.cast(tf.gather(user_matrix, user_idx), tf.float32)
+    return tf.reduce_sum(news_vecs * user_vecs[:, None, :], axis=-1) * mask
+
+
+@njit(cache=True)
+def _counting_sort_order(group_keys):
+    """Stable counting sort of non-negative integer group keys, in linear time."""
+    counts = np.zeros(group_keys.max() + 1, dtype=np.int64)
+    for key in group_keys:
+        counts[key] += 1
+
+    offsets = np.empty_like(counts)
+    total = 0
+    for key in range(len(counts)):
+        offsets[key] = total
+        total += counts[key]
+
+    order = np.empty(len(group_keys), dtype=np.int64)
+    for i in range(len(group_keys)):
+        key = group_keys[i]
+        order[offsets[key]] = i
+        offsets[key] += 1
+    return order
+
+
+class _StepProgress(keras.callbacks.Callback):
+    """Show the training loss every `show_step` steps. Logs are kept as tensors, so that
+    the loss is only copied from the device when it is displayed."""
+
+    def __init__(self, show_step):
+        super().__init__()
+        self.show_step = show_step
+        self._supports_tf_logs = True
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.progress = tqdm()
+        self.next_show_step = self.show_step
+
+    def on_train_batch_end(self, batch, logs=None):
+        step = batch + 1
+        self.progress.update(step - self.progress.n)
+        if step >= self.next_show_step:
+            self.progress.set_description(
+                "step {0:d} , total_loss: {1:.4f}".format(step, float(logs["loss"]))
+            )
+            self.next_show_step = (step // self.show_step + 1) * self.show_step
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.progress.close()
+
+
 class BaseModel:
     """Basic class of models
 
@@ -25,6 +84,7 @@ class BaseModel:
         test_iterator (object): An iterator to load the data in testing steps.
         graph (object): An optional graph.
         seed (int): Random seed.
+        strategy (object): The distribution strategy the model is built under.
     """
 
     def __init__(
@@ -58,18 +118,38 @@ class BaseModel:
 
         self.hparams = hparams
         self.support_quick_scoring = hparams.support_quick_scoring
+        self._eval_datasets = {}
+        self._eval_impressions = {}
 
 
 
-        self.model, self.scorer = self._build_graph()
+        if self.hparams.use_multi_gpu:
+            self.strategy = tf.distribute.MirroredStrategy()
+        else:
+            self.strategy = tf.distribute.get_strategy()
 
-        self.loss = self._get_loss()
-        self.train_optimizer = self._get_opt()
+        with self.strategy.scope():
+            self.model, self.scorer = self._build_graph()
 
-        self.model.compile(loss=self.loss, optimizer=self.train_optimizer)
+            self.loss = self._get_loss()
+            self.train_optimizer = self._get_opt()
+
+            self.model.compile(
+                loss=self.loss,
+                optimizer=self.train_optimizer,
+                steps_per_execution=self.hparams.steps_per_execution,
+            )
+
+        self._scorer_fn = self._make_predict_fn(self.scorer)
+        if hasattr(self, "userencoder"):
+            self._userencoder_fn = self._make_predict_fn(self.userencoder)
+        if hasattr(self, "newsencoder"):
+            self._newsencoder_fn = self._make_predict_fn(self.newsencoder)
 
     def _init_embedding(self, file_path):
-        """Load pre-trained embeddings as a constant tensor.
+        """Load pre-trained embeddings as a read-only memory-mapped array. They are only
+        read once, to initialize the weights of the embedding layer, so the host copy is
+        not kept resident next to the layer variable.
 
         Args:
             file_path (str): the pre-trained glove embeddings file path.
@@ -78,7 +158,7 @@ class BaseModel:
             numpy.ndarray: A constant numpy array.
         """
 
-        return np.load(file_path)
+        return np.load(file_path, mmap_mode="r")
 
     @abc.abstractmethod
     def _build_graph(self):
@@ -144,6 +224,55 @@ class BaseModel:
             )
         return pred
 
+    def _make_predict_fn(self, keras_model):
+        """Wrap the inference of a keras model into an XLA-compiled `tf.function`, so that
+        batches skip the per-call dispatch of `predict_on_batch` and layers get fused.
+        Smaller batches are padded to `batch_size`, so that a single shape is compiled.
+
+        Models with recurrent layers, such as the LSTUR user encoder, are not compiled
+        with XLA, and a model whose XLA compilation fails falls back to the plain
+        `tf.function`.
+
+        Args:
+            keras_model (object): A keras model, such as the scorer or an encoder.
+
+        Returns:
+            object: A function mapping model inputs to model outputs.
+        """
+
+        def call_fn(model_input):
+            return keras_model(model_input, training=False)
+
+        plain_fn = tf.function(call_fn, experimental_relax_shapes=True)
+        if any(
+            isinstance(module, keras.layers.RNN) for module in keras_model.submodules
+        ):
+            compiled_fn = plain_fn
+        else:
+            compiled_fn = tf.function(
+                call_fn, jit_compile=True, experimental_relax_shapes=True
+            )
+
+        def predict_fn(model_input):
+            nonlocal compiled_fn
+            batch_size = len(tf.nest.flatten(model_input)[0])
+            pad_size = self.hparams.batch_size - batch_size
+            if pad_size > 0:
+                model_input = tf.nest.map_structure(
+                    lambda x: np.pad(x, [(0, pad_size)] + [(0, 0)] * (np.ndim(x) - 1)),
+                    model_input,
+                )
+            try:
+                model_output = compiled_fn(model_input)
+            except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError):
+                if compiled_fn is plain_fn:
+                    raise
+                compiled_fn = plain_fn
+                model_output = compiled_fn(model_input)
+            return model_output[:batch_size]
+
+        return predict_fn
+
     def train(self, train_batch_data):
         """Go through the optimization step once with training data in feed_dict.
 
@@ -171,10 +300,75 @@ class BaseModel:
         eval_input, eval_label = self._get_input_label_from_iter(eval_batch_data)
         imp_index = eval_batch_data["impression_index_batch"]
 
-        pred_rslt = self.scorer.predict_on_batch(eval_input)
+        pred_rslt = self._scorer_fn(eval_input).numpy()
 
         return pred_rslt, eval_label, imp_index
 
+    def _make_tf_dataset(self, news_file, behaviors_file):
+        """Wrap the training iterator into a `tf.data.Dataset`, so that batches are prefetched
+        while the model runs its training steps.
+
+        Args:
+            news_file (str): A file contains several informations of news.
+            behaviors_file (str): A file contains information of user impressions.
+
+        Returns:
+            tf.data.Dataset: A dataset yielding (model inputs, labels) batches.
+        """
+
+        def batch_generator():
+            for batch_data_input in self.train_iterator.load_data_from_file(
+                news_file, behaviors_file
+            ):
+                train_input, train_label = self._get_input_label_from_iter(
+                    batch_data_input
+                )
+                yield tuple(train_input), train_label
+
+        output_signature = (
+            tuple(tf.TensorSpec(x.shape, x.dtype) for x in self.model.inputs),
+            tf.TensorSpec(self.model.outputs[0].shape, tf.float32),
+        )
+        dataset = tf.data.Dataset.from_generator(
+            batch_generator, output_signature=output_signature
+        )
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def _get_eval_dataset(self, loader, *files):
+        """Get the cached `tf.data.Dataset` of an evaluation loader of the test iterator.
+        Parsed batches are kept in memory after the first pass, so that later epochs
+        skip the parsing of the evaluation files. This is only meant for the compact news
+        and user loaders, not for `load_data_from_file`, whose batches repeat the clicked
+        history for every candidate.
+
+        Args:
+            loader (object): A loader method of the test iterator, such as `load_news_from_file`.
+            files (str): The files passed to the loader.
+
+        Returns:
+            tf.data.Dataset: A dataset yielding the batches of the loader, in the format of dict.
+
+        Raises:
+            ValueError: If the loader yields no batch for the given files.
+        """
+        key = (loader.__name__,) + files
+        if key not in self._eval_datasets:
+            first_batch = next(loader(*files), None)
+            if first_batch is None:
+                raise ValueError(
+                    "{0} yields no batch for {1}".format(loader.__name__, files)
+                )
+            output_signature = {
+                name: tf.TensorSpec((None,) + value.shape[1:], tf.as_dtype(value.dtype))
+                for name, value in first_batch.items()
+            }
+            dataset = tf.data.Dataset.from_generator(
+                lambda: loader(*files), output_signature=output_signature
+            )
+            self._eval_datasets[key] = dataset.cache().prefetch(tf.data.AUTOTUNE)
+
+        return self._eval_datasets[key]
+
     def fit(
         self,
         train_news_file,
@@ -196,31 +390,19 @@ class BaseModel:
             object: An instance of self.
         """
 
+        train_ds = self._make_tf_dataset(train_news_file, train_behaviors_file)
+
         for epoch in range(1, self.hparams.epochs + 1):
-            step = 0
             self.hparams.current_epoch = epoch
-            epoch_loss = 0
             train_start = time.time()
 
-            tqdm_util = tqdm(
-                self.train_iterator.load_data_from_file(
-                    train_news_file, train_behaviors_file
-                )
+            history = self.model.fit(
+                train_ds,
+                epochs=1,
+                verbose=0,
+                callbacks=[_StepProgress(self.hparams.show_step)],
             )
-
-            for batch_data_input in tqdm_util:
-
-                step_result = self.train(batch_data_input)
-                step_data_loss = step_result
-
-                epoch_loss += step_data_loss
-                step += 1
-                if step % self.hparams.show_step == 0:
-                    tqdm_util.set_description(
-                        "step {0:d} , total_loss: {1:.4f}, data_loss: {2:.4f}".format(
-                            step, epoch_loss / step, step_data_loss
-                        )
-                    )
+            epoch_loss = history.history["loss"][-1]
 
             train_end = time.time()
             train_time = train_end - train_start
@@ -230,7 +412,7 @@ class BaseModel:
             train_info = ",".join(
                 [
                     str(item[0]) + ":" + str(item[1])
-                    for item in [("logloss loss", epoch_loss / step)]
+                    for item in [("logloss loss", epoch_loss)]
                 ]
             )
 
@@ -288,26 +470,37 @@ class BaseModel:
 
         Returns:
             list, list, list:
-            - Keys after group.
-            - Labels after group.
-            - Preds after group.
+            - Keys after group, in ascending order.
+            - Labels after group, one numpy.ndarray per key.
+            - Preds after group, one numpy.ndarray per key.
 
         """
 
-        all_keys = list(set(group_keys))
-        all_keys.sort()
-        group_labels = {k: [] for k in all_keys}
-        group_preds = {k: [] for k in all_keys}
-
-        for label, p, k in zip(labels, preds, group_keys):
-            group_labels[k].append(label)
-            group_preds[k].append(p)
+        labels = np.asarray(labels)
+        preds = np.asarray(preds)
+        group_keys = np.asarray(group_keys)
+        if group_keys.size == 0:
+            return [], [], []
+
+        # a stable sort keeps the original order of the samples inside each group,
+        # dense impression indexes are sorted in linear time
+        if (
+            np.issubdtype(group_keys.dtype, np.integer)
+            and group_keys.min() >= 0
+            and group_keys.max() < 2 * group_keys.size
+        ):
+            order = _counting_sort_order(group_keys)
+        else:
+            order = np.argsort(group_keys, kind="stable")
+        sorted_keys = group_keys[order]
+        is_first = np.ones(len(sorted_keys), dtype=bool)
+        is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        starts = np.flatnonzero(is_first)
+        boundaries = starts[1:]
 
-        all_labels = []
-        all_preds = []
-        for k in all_keys:
-            all_labels.append(group_labels[k])
-            all_preds.append(group_preds[k])
+        all_keys = sorted_keys[starts].tolist()
+        all_labels = np.split(labels[order], boundaries)
+        all_preds = np.split(preds[order], boundaries)
 
         return all_keys, all_labels, all_preds
 
@@ -334,47 +527,76 @@ class BaseModel:
 
     def user(self, batch_user_input):
         user_input = self._get_user_feature_from_iter(batch_user_input)
-        user_vec = self.userencoder.predict_on_batch(user_input)
+        user_vec = self._userencoder_fn(user_input).numpy()
         user_index = batch_user_input["impr_index_batch"]
 
         return user_index, user_vec
 
     def news(self, batch_news_input):
         news_input = self._get_news_feature_from_iter(batch_news_input)
-        news_vec = self.newsencoder.predict_on_batch(news_input)
+        news_vec = self._newsencoder_fn(news_input).numpy()
         news_index = batch_news_input["news_index_batch"]
 
         return news_index, news_vec
 
     def run_user(self, news_filename, behaviors_file):
+        """Encode the users of all impressions of the given files.
+
+        Args:
+            news_filename (str): A file contains several informations of news.
+            behaviors_file (str): A file contains information of user impressions.
+
+        Returns:
+            numpy.ndarray, numpy.ndarray:
+            - Impression indexes.
+            - User vectors, one row per impression index.
+        """
         if not hasattr(self, "userencoder"):
             raise ValueError("model must have attribute userencoder")
 
         user_indexes = []
         user_vecs = []
-        for batch_data_input in tqdm(
-            self.test_iterator.load_user_from_file(news_filename, behaviors_file)
-        ):
+        dataset = self._get_eval_dataset(
+            self.test_iterator.load_user_from_file, news_filename, behaviors_file
+        )
+        for batch_data_input in tqdm(dataset.as_numpy_iterator()):
             user_index, user_vec = self.user(batch_data_input)
-            user_indexes.extend(np.reshape(user_index, -1))
-            user_vecs.extend(user_vec)
+            user_indexes.append(np.reshape(user_index, -1))
+            user_vecs.append(np.asarray(user_vec))
 
-        return dict(zip(user_indexes, user_vecs))
+        user_indexes = np.concatenate(user_indexes)
+        user_vecs = np.concatenate(user_vecs, axis=0)
+
+        return user_indexes, user_vecs
 
     def run_news(self, news_filename):
+        """Encode all news of the given file.
+
+        Args:
+            news_filename (str): A file contains several informations of news.
+
+        Returns:
+            numpy.ndarray, numpy.ndarray:
+            - News indexes.
+            - News vectors, one row per news index.
+        """
         if not hasattr(self, "newsencoder"):
             raise ValueError("model must have attribute newsencoder")
 
         news_indexes = []
         news_vecs = []
-        for batch_data_input in tqdm(
-            self.test_iterator.load_news_from_file(news_filename)
-        ):
+        dataset = self._get_eval_dataset(
+            self.test_iterator.load_news_from_file, news_filename
+        )
+        for batch_data_input in tqdm(dataset.as_numpy_iterator()):
             news_index, news_vec = self.news(batch_data_input)
-            news_indexes.extend(np.reshape(news_index, -1))
-            news_vecs.extend(news_vec)
+            news_indexes.append(np.reshape(news_index, -1))
+            news_vecs.append(np.asarray(news_vec))
 
-        return dict(zip(news_indexes, news_vecs))
+        news_indexes = np.concatenate(news_indexes)
+        news_vecs = np.concatenate(news_vecs, axis=0)
+
+        return news_indexes, news_vecs
 
     def run_slow_eval(self, news_filename, behaviors_file):
         preds = []
@@ -385,9 +607,13 @@ class BaseModel:
             self.test_iterator.load_data_from_file(news_filename, behaviors_file)
         ):
             step_pred, step_labels, step_imp_index = self.eval(batch_data_input)
-            preds.extend(np.reshape(step_pred, -1))
-            labels.extend(np.reshape(step_labels, -1))
-            imp_indexes.extend(np.reshape(step_imp_index, -1))
+            preds.append(np.reshape(step_pred, -1))
+            labels.append(np.reshape(step_labels, -1))
+            imp_indexes.append(np.reshape(step_imp_index, -1))
+
+        preds = np.concatenate(preds)
+        labels = np.concatenate(labels)
+        imp_indexes = np.concatenate(imp_indexes)
 
         group_impr_indexes, group_labels, group_preds = self.group_labels(
             labels, preds, imp_indexes
@@ -395,32 +621,259 @@ class BaseModel:
         return group_impr_indexes, group_labels, group_preds
 
     def run_fast_eval(self, news_filename, behaviors_file):
-        news_vecs = self.run_news(news_filename)
-        user_vecs = self.run_user(news_filename, behaviors_file)
-
-        self.news_vecs = news_vecs
-        self.user_vecs = user_vecs
-
-        group_impr_indexes = []
-        group_labels = []
-        group_preds = []
-
-        for (
-            impr_index,
-            news_index,
-            user_index,
-            label,
-        ) in tqdm(self.test_iterator.load_impression_from_file(behaviors_file)):
-            pred = np.dot(
-                np.stack([news_vecs[i] for i in news_index], axis=0),
-                user_vecs[impr_index],
+        news_indexes, self.news_mat = self.run_news(news_filename)
+        impr_indexes, self.user_mat = self.run_user(news_filename, behaviors_file)
+
+        self.news_id_to_row = self._index_to_row(news_indexes)
+        self.user_id_to_row = self._index_to_row(impr_indexes)
+
+        if self.hparams.half_precision_scoring:
+            self.news_mat = self.news_mat.astype(np.float16)
+            self.user_mat = self.user_mat.astype(np.float16)
+
+        if self.hparams.eval_vecs_dir:
+            self.news_mat = self._to_memmap(self.news_mat, "news_vecs", news_filename)
+            self.user_mat = self._to_memmap(
+                self.user_mat, "user_vecs", news_filename, behaviors_file
+            )
+
+        (
+            group_impr_indexes,
+            group_labels,
+            news_indexes,
+            news_offsets,
+        ) = self._load_impressions(behaviors_file)
+        news_rows = self._lookup_rows(self.news_id_to_row, news_indexes, "news")
+        group_news_rows = (
+            np.split(news_rows, news_offsets) if len(group_impr_indexes) else []
+        )
+        group_user_rows = self._lookup_rows(
+            self.user_id_to_row, group_impr_indexes, "impression"
+        )
+
+        if tf.config.list_physical_devices("GPU"):
+            group_preds = self._score_impressions_on_device(
+                self.news_mat, self.user_mat, group_news_rows, group_user_rows
+            )
+        else:
+            group_preds = self._score_impressions_on_host(
+                self.news_mat, self.user_mat, group_news_rows, group_user_rows
             )
-            group_impr_indexes.append(impr_index)
-            group_labels.append(label)
-            group_preds.append(pred)
 
         return group_impr_indexes, group_labels, group_preds
 
+    def _load_impressions(self, behaviors_file):
+        """Load the impressions of a behaviors file. They are parsed once and kept for
+        the evaluations of later epochs.
+
+        Args:
+            behaviors_file (str): A file contains information of user impressions.
+
+        Returns:
+            numpy.ndarray, list, numpy.ndarray, numpy.ndarray:
+            - Impression indexes.
+            - Labels of each impression.
+            - Candidate news indexes of all impressions, concatenated.
+            - Offsets splitting the candidate news indexes per impression.
+        """
+        if behaviors_file not in self._eval_impressions:
+            if not hasattr(self.test_iterator, "impr_indexes"):
+                self.test_iterator.init_behaviors(behaviors_file)
+
+            num_impressions = len(self.test_iterator.impr_indexes)
+            impr_indexes = np.empty(num_impressions, dtype=np.int64)
+            labels = [None] * num_impressions
+            news_indexes = [None] * num_impressions
+            news_lengths = np.empty(num_impressions, dtype=np.int64)
+
+            for i, (impr_index, news_index, user_index, label) in enumerate(
+                tqdm(self.test_iterator.load_impression_from_file(behaviors_file))
+            ):
+                impr_indexes[i] = impr_index
+                labels[i] = label
+                news_indexes[i] = news_index
+                news_lengths[i] = len(news_index)
+
+            self._eval_impressions[behaviors_file] = (
+                impr_indexes,
+                labels,
+                np.concatenate(news_indexes)
+                if num_impressions
+                else np.empty(0, dtype=np.int64),
+                np.cumsum(news_lengths)[:-1],
+            )
+
+        return self._eval_impressions[behaviors_file]
+
+    def _to_memmap(self, vecs, name, *source_files):
+        """Save vectors in `eval_vecs_dir` and memory-map them back, so that the rows
+        gathered by the host scorer are paged in from disk after the evaluation instead
+        of being held in memory, and the file can be shared with other processes.
+
+        This does not lower the peak memory of an evaluation: the full matrix is built
+        in memory before it is saved, and the GPU scorer copies the whole matrix to the
+        device anyway.
+
+        The file name is keyed on the source files, so that validation and test vectors
+        do not overwrite each other. The file is written to a temporary file first and
+        then moved into place, so that processes still mapping the previous file keep
+        reading valid pages.
+
+        Args:
+            vecs (numpy.ndarray): vectors to save.
+            name (str): prefix of the file name in `eval_vecs_dir`.
+            source_files (str): the files the vectors are computed from.
+
+        Returns:
+            numpy.memmap: A read-only memory-mapped array of the vectors.
+        """
+        os.makedirs(self.hparams.eval_vecs_dir, exist_ok=True)
+        source_key = hashlib.md5("\n".join(source_files).encode("utf-8")).hexdigest()
+        file_path = os.path.join(
+            self.hparams.eval_vecs_dir, "{0}_{1}.npy".format(name, source_key)
+        )
+        tmp_file = tempfile.NamedTemporaryFile(
+            dir=self.hparams.eval_vecs_dir, suffix=".npy", delete=False
+        )
+        try:
+            with tmp_file:
+                np.save(tmp_file, vecs)
+            os.replace(tmp_file.name, file_path)
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+        return np.load(file_path, mmap_mode="r")
+
+    @staticmethod
+    def _index_to_row(indexes):
+        """Build a lookup array from indexes to the rows they are stored at.
+
+        Args:
+            indexes (numpy.ndarray): index of each row.
+
+        Returns:
+            numpy.ndarray: row of each index, -1 for indexes that are not stored.
+        """
+        index_to_row = np.full(indexes.max() + 1, -1, dtype=np.int64)
+        index_to_row[indexes] = np.arange(len(indexes))
+        return index_to_row
+
+    @staticmethod
+    def _lookup_rows(index_to_row, indexes, name):
+        """Look up the rows of indexes in an array built by `_index_to_row`.
+
+        Args:
+            index_to_row (numpy.ndarray): row of each index, -1 for indexes that are not stored.
+            indexes (numpy.ndarray): indexes to look up.
+            name (str): name of the indexes, for the error message.
+
+        Returns:
+            numpy.ndarray: row of each index.
+
+        Raises:
+            KeyError: If some indexes are not stored.
+        """
+        indexes = np.asarray(indexes)
+        in_range = (indexes >= 0) & (indexes < len(index_to_row))
+        rows = np.full(indexes.shape, -1, dtype=index_to_row.dtype)
+        rows[in_range] = index_to_row[indexes[in_range]]
+        if (rows < 0).any():
+            raise KeyError(
+                "{0} indexes {1} were not encoded".format(
+                    name, indexes[rows < 0][:10].tolist()
+                )
+            )
+        return rows
+
+    @staticmethod
+    def _score_impressions_on_host(
+        news_matrix,
+        user_matrix,
+        group_news_rows,
+        group_user_rows,
+        chunk_size=1024,
+    ):
+        """Score impressions with NumPy. Impressions with the same number of candidates
+        are scored together, with one batched product per chunk.
+
+        Args:
+            news_matrix (numpy.ndarray): news vectors, one row per news.
+            user_matrix (numpy.ndarray): user vectors, one row per impression.
+            group_news_rows (list): rows of the candidate news of each impression.
+            group_user_rows (numpy.ndarray): row of the user vector of each impression.
+            chunk_size (int): maximum number of impressions scored at once.
+
+        Returns:
+            list: prediction scores of each impression.
+        """
+        buckets = {}
+        for pos, news_rows in enumerate(group_news_rows):
+            buckets.setdefault(len(news_rows), []).append(pos)
+
+        group_preds = [None] * len(group_news_rows)
+        for positions in buckets.values():
+            for start in range(0, len(positions), chunk_size):
+                chunk = positions[start : start + chunk_size]
+                news_rows = np.stack([group_news_rows[pos] for pos in chunk])
+                user_rows = group_user_rows[chunk]
+                preds = np.einsum(
+                    "bnd,bd->bn",
+                    news_matrix[news_rows].astype(np.float32, copy=False),
+                    user_matrix[user_rows].astype(np.float32, copy=False),
+                )
+                for pos, pred in zip(chunk, preds):
+                    group_preds[pos] = pred
+
+        return group_preds
+
+    @staticmethod
+    def _score_impressions_on_device(
+        news_matrix,
+        user_matrix,
+        group_news_rows,
+        group_user_rows,
+        chunk_size=1024,
+    ):
+        """Score impressions on the GPU. Chunks of impressions are padded to a fixed number
+        of impressions and to a power of two candidates, so that only a few shapes of the
+        XLA scoring kernel get compiled.
+
+        Args:
+            news_matrix (numpy.ndarray): news vectors, one row per news.
+            user_matrix (numpy.ndarray): user vectors, one row per impression.
+            group_news_rows (list): rows of the candidate news of each impression.
+            group_user_rows (numpy.ndarray): row of the user vector of each impression.
+            chunk_size (int): number of impressions scored at once.
+
+        Returns:
+            list: prediction scores of each impression.
+        """
+        with tf.device("/GPU:0"):
+            news_tensor = tf.identity(news_matrix)
+            user_tensor = tf.identity(user_matrix)
+
+        group_preds = [None] * len(group_news_rows)
+        for start in range(0, len(group_news_rows), chunk_size):
+            chunk = group_news_rows[start : start + chunk_size]
+            lengths = [len(news_rows) for news_rows in chunk]
+            width = 1 << (max(max(lengths), 1) - 1).bit_length()
+
+            news_idx = np.zeros((chunk_size, width), dtype=np.int32)
+            mask = np.zeros((chunk_size, width), dtype=np.float32)
+            user_idx = np.zeros(chunk_size, dtype=np.int32)
+            for i, news_rows in enumerate(chunk):
+                news_idx[i, : len(news_rows)] = news_rows
+                mask[i, : len(news_rows)] = 1.0
+            user_idx[: len(chunk)] = group_user_rows[start : start + chunk_size]
+
+            preds = _masked_gather_dot(
+                news_tensor, user_tensor, news_idx, user_idx, mask
+            ).numpy()
+            for i, (pred, length) in enumerate(zip(preds, lengths)):
+                group_preds[start + i] = pred[:length]
+
+        return group_preds
+
     def custom_fit(
         self,
         train_news_file,
@@ -438,6 +891,8 @@ class BaseModel:
         if hasattr(self.hparams, "use_early_stopping") and self.hparams.use_early_stopping:
             self.last_eval_res = deque() # the last evaluations to compare for early stopping
 
+        train_ds = self._make_tf_dataset(train_news_file, train_behaviors_file)
+
         for epoch in range(1, self.hparams.epochs + 1):
 
             # fine step for last epochs
@@ -446,31 +901,16 @@ class BaseModel:
                     print('\nDecreasing learning rate for new plateau')
                     self.model.optimizer.learning_rate = self.hparams.learning_rate * self.hparams.fine_step_factor
 
-            step = 0
             self.hparams.current_epoch = epoch
-            epoch_loss = 0
-
             train_start = time.time()
 
-            tqdm_util = tqdm(
-                self.train_iterator.load_data_from_file(
-                    train_news_file, train_behaviors_file
-                )
+            history = self.model.fit(
+                train_ds,
+                epochs=1,
+                verbose=0,
+                callbacks=[_StepProgress(self.hparams.show_step)],
             )
-
-            for batch_data_input in tqdm_util:
-
-                step_result = self.train(batch_data_input)
-                step_data_loss = step_result
-
-                epoch_loss += step_data_loss
-                step += 1
-                if step % self.hparams.show_step == 0:
-                    tqdm_util.set_description(
-                        "step {0:d} , total_loss: {1:.4f}, data_loss: {2:.4f}".format(
-                            step, epoch_loss / step, step_data_loss
-                        )
-                    )
+            epoch_loss = history.history["loss"][-1]
 
             train_end = time.time()
             train_time = train_end - train_start
@@ -480,7 +920,7 @@ class BaseModel:
             train_info = ",".join(
                 [
                     str(item[0]) + ":" + str(item[1])
-                    for item in [("logloss loss", epoch_loss / step)]
+                    for item in [("logloss loss", epoch_loss)]
                 ]
             )
 
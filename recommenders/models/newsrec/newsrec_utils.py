@@ -31,6 +31,7 @@ def check_type(config):
         "attention_hidden_dim",
         "epochs",
         "batch_size",
+        "steps_per_execution",
         "show_step",
         "save_epoch",
         "head_num",
@@ -63,6 +64,7 @@ def check_type(config):
         "optimizer",
         "cnn_activation",
         "dense_activation" "type",
+        "eval_vecs_dir",
     ]
     for param in str_parameters:
         if param in config and not isinstance(config[param], str):
@@ -73,7 +75,11 @@ def check_type(config):
         if param in config and not isinstance(config[param], list):
             raise TypeError("Parameters {0} must be list".format(param))
 
-    bool_parameters = ["support_quick_scoring"]
+    bool_parameters = [
+        "support_quick_scoring",
+        "half_precision_scoring",
+        "use_multi_gpu",
+    ]
     for param in bool_parameters:
         if param in config and not isinstance(config[param], bool):
             raise TypeError("Parameters {0} must be bool".format(param))
@@ -216,6 +222,8 @@ def create_hparams(flags):
     init_dict = {
         # data
         "support_quick_scoring": False,
+        "half_precision_scoring": False,
+        "eval_vecs_dir": "",
         # models
         "dropout": 0.0,
         "attention_hidden_dim": 200,
@@ -235,8 +243,10 @@ def create_hparams(flags):
         # train
         "learning_rate": 0.001,
         "optimizer": "adam",
+        "use_multi_gpu": False,
         "epochs": 10,
         "batch_size": 1,
+        "steps_per_execution": 1,
         # show info
         "show_step": 1,
     }
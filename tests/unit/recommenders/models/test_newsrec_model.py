@@ -2,13 +2,19 @@
 # Licensed under the MIT License.
 
 import os
+import pickle
+import numpy as np
 import pytest
 
 try:
     from recommenders.models.deeprec.deeprec_utils import download_deeprec_resources
     from recommenders.models.newsrec.io.mind_all_iterator import MINDAllIterator
     from recommenders.models.newsrec.io.mind_iterator import MINDIterator
-    from recommenders.models.newsrec.newsrec_utils import prepare_hparams
+    from recommenders.models.newsrec.newsrec_utils import (
+        create_hparams,
+        prepare_hparams,
+    )
+    from recommenders.models.newsrec.models.base_model import BaseModel
     from recommenders.models.newsrec.models.lstur import LSTURModel
     from recommenders.models.newsrec.models.naml import NAMLModel
     from recommenders.models.newsrec.models.npa import NPAModel
@@ -138,3 +144,136 @@ def test_lstur_component_definition(mind_resource_path):
     assert model.scorer is not None
     assert model.loss is not None
     assert model.train_optimizer is not None
+
+
+@pytest.mark.gpu
+def test_group_labels():
+    labels = [1, 0, 1, 0, 1]
+    preds = [0.1, 0.2, 0.3, 0.4, 0.5]
+    group_keys = [2, 1, 2, 0, 1]
+
+    all_keys, all_labels, all_preds = BaseModel.group_labels(
+        None, labels, preds, group_keys
+    )
+
+    assert all_keys == [0, 1, 2]
+    for result, expected in zip(all_labels, [[0], [0, 1], [1, 1]]):
+        np.testing.assert_array_equal(result, expected)
+    for result, expected in zip(all_preds, [[0.4], [0.2, 0.5], [0.1, 0.3]]):
+        np.testing.assert_allclose(result, expected)
+
+    assert BaseModel.group_labels(None, [], [], []) == ([], [], [])
+
+
+def _random_impressions(num_news=30, num_users=40, dim=16, seed=42):
+    rng = np.random.default_rng(seed)
+    news_matrix = rng.normal(size=(num_news, dim)).astype(np.float32)
+    user_matrix = rng.normal(size=(num_users, dim)).astype(np.float32)
+    group_news_rows = [
+        rng.integers(0, num_news, size=rng.integers(1, 5)) for _ in range(num_users)
+    ]
+    group_user_rows = rng.permutation(num_users)
+    return news_matrix, user_matrix, group_news_rows, group_user_rows
+
+
+@pytest.mark.gpu
+def test_score_impressions():
+    news_matrix, user_matrix, group_news_rows, group_user_rows = _random_impressions()
+    expected = [
+        np.dot(news_matrix[news_rows], user_matrix[user_row])
+        for news_rows, user_row in zip(group_news_rows, group_user_rows)
+    ]
+
+    # candidate counts of 1 to 4 give buckets of about 10 impressions, which a chunk
+    # size of 4 splits over several chunks
+    for score_fn in [
+        BaseModel._score_impressions_on_host,
+        BaseModel._score_impressions_on_device,
+    ]:
+        group_preds = score_fn(
+            news_matrix,
+            user_matrix,
+            group_news_rows,
+            group_user_rows,
+            chunk_size=4,
+        )
+        assert len(group_preds) == len(expected)
+        for pred, expected_pred in zip(group_preds, expected):
+            np.testing.assert_allclose(pred, expected_pred, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.gpu
+def test_score_impressions_half_precision():
+    news_matrix, user_matrix, group_news_rows, group_user_rows = _random_impressions()
+
+    full_preds = BaseModel._score_impressions_on_host(
+        news_matrix, user_matrix, group_news_rows, group_user_rows
+    )
+    half_preds = BaseModel._score_impressions_on_host(
+        news_matrix.astype(np.float16),
+        user_matrix.astype(np.float16),
+        group_news_rows,
+        group_user_rows,
+    )
+
+    for half_pred, full_pred in zip(half_preds, full_preds):
+        assert half_pred.dtype == np.float32
+        np.testing.assert_allclose(half_pred, full_pred, rtol=1e-2, atol=1e-2)
+
+
+@pytest.mark.gpu
+def test_lookup_rows():
+    index_to_row = BaseModel._index_to_row(np.array([3, 0, 5]))
+
+    np.testing.assert_array_equal(
+        BaseModel._lookup_rows(index_to_row, np.array([5, 3, 0]), "news"),
+        [2, 0, 1],
+    )
+    for missing_index in [1, 9, -1]:
+        with pytest.raises(KeyError):
+            BaseModel._lookup_rows(index_to_row, np.array([missing_index]), "news")
+
+
+@pytest.mark.gpu
+def test_mind_all_iterator_eval_batches(tmp):
+    news_file = os.path.join(tmp, "news.tsv")
+    behaviors_file = os.path.join(tmp, "behaviors.tsv")
+    with open(news_file, "w") as f:
+        for i in range(6):
+            f.write(
+                "N{0}\tsports\tsoccer\ttitle {0}\tabstract {0}\turl\t[]\t[]\n".format(i)
+            )
+    with open(behaviors_file, "w") as f:
+        for i in range(5):
+            f.write("{0}\tU{0}\ttime\tN0 N1\tN2-1 N3-0\n".format(i))
+
+    dict_files = {}
+    for name, content in [
+        ("wordDict_file", {"title": 1, "abstract": 2}),
+        ("vertDict_file", {"sports": 1}),
+        ("subvertDict_file", {"soccer": 1}),
+        ("userDict_file", {"U0": 1, "U1": 2}),
+    ]:
+        dict_files[name] = os.path.join(tmp, name + ".pkl")
+        with open(dict_files[name], "wb") as f:
+            pickle.dump(content, f)
+
+    hparams = create_hparams(
+        dict(batch_size=2, title_size=4, body_size=4, his_size=3, **dict_files)
+    )
+    iterator = MINDAllIterator(hparams)
+
+    # the 6 news and the padding news give 7 rows, the 5 impressions give 5 users
+    news_batches = list(iterator.load_news_from_file(news_file))
+    user_batches = list(iterator.load_user_from_file(news_file, behaviors_file))
+
+    assert [len(batch["news_index_batch"]) for batch in news_batches] == [2, 2, 2, 1]
+    assert [len(batch["user_index_batch"]) for batch in user_batches] == [2, 2, 1]
+    np.testing.assert_array_equal(
+        np.concatenate([batch["news_index_batch"] for batch in news_batches]),
+        np.arange(7),
+    )
+    np.testing.assert_array_equal(
+        np.concatenate([batch["impr_index_batch"] for batch in user_batches]),
+        np.arange(5),
+    )